@@ -0,0 +1,157 @@
+"""
+SpecEI Analysis Cache
+Content-addressed SQLite cache for Groq analysis results.
+Re-syncing unchanged media hits the cache instead of Whisper / LLaVA.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+# Faster JSON when orjson is installed (pip install orjson)
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(value: Any) -> str:
+        return orjson.dumps(value).decode()
+except ImportError:
+    import json
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Load environment
+try:
+    from dotenv import load_dotenv
+    env_path = os.path.join(os.path.dirname(__file__), '.env')
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+logger = logging.getLogger("SpecEI.AnalysisCache")
+
+# Cache config
+CACHE_DB_PATH = os.environ.get(
+    "SPECEI_CACHE_DB",
+    os.path.join(os.path.dirname(__file__), "analysis_cache.db")
+)
+# Entry lifetime in seconds; 0 keeps entries forever
+CACHE_TTL = float(os.environ.get("SPECEI_CACHE_TTL", "0") or 0)
+
+
+def file_digest(path: str, chunk_size: int = 65536) -> str:
+    """SHA-256 of a file's content, read in chunks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(digest: str, model: str) -> str:
+    """Cache key for a (content digest, model) pair"""
+    return hashlib.sha256(f"{digest}|{model}".encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Key → JSON store backed by SQLite.
+    Safe to share between threads; all access goes through one lock.
+    Storage errors never propagate: the cache disables itself if the DB can't
+    be opened, and a failed read/write is logged and treated as a miss / no-op.
+    """
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl: float = CACHE_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+        
+        conn = None
+        try:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, json TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[WARN] Analysis cache disabled, cannot open {db_path}: {e}")
+            if conn is not None:
+                conn.close()
+            return
+        
+        self._conn = conn
+        logger.info(f"[OK] Analysis cache at {db_path} (ttl={ttl or 'none'})")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return cached value, or None on miss / expiry / storage error"""
+        if self._conn is None:
+            return None
+        
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT json, created_at FROM cache WHERE key=?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                
+                if self.ttl and time.time() - row[1] > self.ttl:
+                    self._conn.execute("DELETE FROM cache WHERE key=?", (key,))
+                    self._conn.commit()
+                    return None
+            except sqlite3.Error as e:
+                logger.warning(f"[WARN] Analysis cache read failed: {e}")
+                self._rollback()
+                return None
+
+        try:
+            return _json_loads(row[0])
+        except ValueError:
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a JSON-serializable value under key"""
+        try:
+            payload = _json_dumps(value)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"[WARN] Not caching unserializable result: {e}")
+            return
+
+        if self._conn is None:
+            return
+        
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, json, created_at) VALUES (?, ?, ?)",
+                    (key, payload, time.time())
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"[WARN] Analysis cache write failed: {e}")
+                self._rollback()
+    
+    def _rollback(self):
+        """Drop a half-finished transaction after a failed statement (lock held)"""
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+
+# Singleton
+_cache = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Get singleton analysis cache"""
+    global _cache
+    if _cache is None:
+        _cache = AnalysisCache()
+    return _cache
@@ -7,10 +7,20 @@ Unified service for Groq's cloud-based AI:
 """
 
 import os
+import re
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from groq import Groq
 
+# Faster JSON parsing when orjson is installed (pip install orjson)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
 # Load environment from AI_Backend directory
 try:
     from dotenv import load_dotenv
@@ -27,6 +37,16 @@ logger = logging.getLogger("SpecEI.GroqCloud")
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 print(f"🔑 GROQ_API_KEY: {'Found (' + GROQ_API_KEY[:10] + '...)' if GROQ_API_KEY else 'NOT FOUND'}")
 
+# Groq Whisper model (also part of transcript cache keys)
+WHISPER_MODEL = "whisper-large-v3-turbo"
+
+# Forensic analysis sampling; results are only cached when near-deterministic
+FORENSIC_TEMPERATURE = 0.1
+CACHE_MAX_TEMPERATURE = 0.2
+
+# Markdown code fence around model JSON output (closing fence optional)
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)(?:```|\Z)", re.DOTALL)
+
 
 class GroqCloudService:
     """
@@ -70,10 +90,12 @@ class GroqCloudService:
             return {"error": "Groq service not available", "text": "", "segments": []}
         
         try:
+            # Pass the open handle (not .read()) so the upload streams from disk;
+            # the content type is guessed from the filename
             with open(audio_path, "rb") as file:
                 transcription = self.client.audio.transcriptions.create(
-                    file=(os.path.basename(audio_path), file.read()),
-                    model="whisper-large-v3-turbo",
+                    file=(os.path.basename(audio_path), file),
+                    model=WHISPER_MODEL,
                     temperature=0,
                     response_format="verbose_json",
                 )
@@ -136,24 +158,12 @@ class GroqCloudService:
         
         try:
             if stream:
-                # Streaming response
-                completion = self.client.chat.completions.create(
-                    model="openai/gpt-oss-120b",
-                    messages=messages,
+                # Streaming response, joined once at the end
+                content = "".join(self.chat_completion_stream(
+                    messages,
                     temperature=temperature,
-                    max_completion_tokens=max_tokens,
-                    top_p=1,
-                    reasoning_effort="medium",
-                    stream=True,
-                    stop=None
-                )
-                
-                # Collect streamed content
-                content = ""
-                for chunk in completion:
-                    delta = chunk.choices[0].delta.content
-                    if delta:
-                        content += delta
+                    max_tokens=max_tokens
+                ))
                 
                 return {"content": content, "model": "openai/gpt-oss-120b"}
             else:
@@ -176,11 +186,51 @@ class GroqCloudService:
             logger.error(f"❌ Groq LLM error: {e}")
             return {"error": str(e), "content": ""}
     
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: int = 2048
+    ) -> Iterator[str]:
+        """
+        Stream a chat completion from GPT-oss-120b.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            
+        Yields:
+            Text deltas as they arrive (pass straight to FastAPI's StreamingResponse)
+            
+        Raises:
+            RuntimeError: If the Groq service is not available
+        """
+        if not self.available:
+            raise RuntimeError("Groq service not available")
+        
+        completion = self.client.chat.completions.create(
+            model="openai/gpt-oss-120b",
+            messages=messages,
+            temperature=temperature,
+            max_completion_tokens=max_tokens,
+            top_p=1,
+            reasoning_effort="medium",
+            stream=True,
+            stop=None
+        )
+        
+        for chunk in completion:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    
     def generate_forensic_analysis(
         self,
         evidence_text: str,
         media_id: str,
-        user_id: str
+        user_id: str,
+        temperature: float = FORENSIC_TEMPERATURE
     ) -> Optional[Dict]:
         """
         Generate forensic memory log using GPT-oss-120b.
@@ -189,6 +239,7 @@ class GroqCloudService:
             evidence_text: Formatted evidence from visual/audio analysis
             media_id: Unique media identifier
             user_id: User who owns the media
+            temperature: Sampling temperature (results cached only up to CACHE_MAX_TEMPERATURE)
             
         Returns:
             Structured forensic log dictionary
@@ -240,12 +291,28 @@ USER ID: {user_id}
 
 Generate the forensic memory JSON now."""
 
+        # Same prompt → same log. The key covers the full user prompt (ids
+        # included), so output that echoes one user's ids is never served to another.
+        cache = None
+        if temperature <= CACHE_MAX_TEMPERATURE:
+            from analysis_cache import get_analysis_cache
+            cache = get_analysis_cache()
+            cache_key = hashlib.sha256(
+                f"openai/gpt-oss-120b|{temperature}|{system_prompt}|{user_prompt}".encode()
+            ).hexdigest()
+            cached = cache.get(cache_key)
+            if isinstance(cached, dict):
+                cached["media_id"] = media_id
+                cached["user_id"] = user_id
+                logger.info(f"🔬 Forensic analysis cache hit for {media_id}")
+                return cached
+
         result = self.chat_completion(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.1,
+            temperature=temperature,
             max_tokens=2048
         )
         
@@ -253,18 +320,20 @@ Generate the forensic memory JSON now."""
             return None
         
         try:
-            import json
             content = result.get("content", "")
             
             # Clean markdown wrapping
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
+            m = _FENCE_RE.search(content)
+            if m:
+                content = m.group(1)
             
-            forensic_log = json.loads(content.strip())
+            forensic_log = _json_loads(content.strip())
+            if not isinstance(forensic_log, dict):
+                raise ValueError(f"expected a JSON object, got {type(forensic_log).__name__}")
             forensic_log["media_id"] = media_id
             forensic_log["user_id"] = user_id
+            if cache is not None:
+                cache.set(cache_key, forensic_log)
             
             logger.info(f"🔬 Forensic analysis generated for {media_id}")
             return forensic_log
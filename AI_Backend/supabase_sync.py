@@ -4,12 +4,24 @@ Fetches media from Supabase, analyzes with Groq, stores in Supermemory.
 """
 
 import os
+import math
+import shutil
+import asyncio
+import hashlib
 import logging
 import tempfile
 import httpx
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
+# Faster JSON parsing when orjson is installed (pip install orjson)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
 # Load environment
 try:
     from dotenv import load_dotenv
@@ -24,6 +36,128 @@ logger = logging.getLogger("SpecEI.SupabaseSync")
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY", "")
 
+# Sync pipeline: workers per stage and queue bound between stages (backpressure)
+DOWNLOAD_WORKERS = 16  # I/O bound
+ANALYZE_WORKERS = 4    # Groq bound, kept low for rate limits
+STORE_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 32
+
+# End-of-stream marker passed through pipeline queues
+_DONE = object()
+
+# Supermemory write retries on rate limits (429) / server errors (5xx)
+STORE_MAX_RETRIES = 4
+STORE_BACKOFF_BASE = 0.5  # seconds, doubled per attempt
+
+# Preflight: media below these limits skips the Groq calls entirely
+MIN_MEDIA_BYTES = 4096
+MIN_MEDIA_DURATION = 0.5  # seconds
+SILENCE_DBFS = -50.0      # short audio-only clips quieter than this skip Whisper
+SILENCE_PROBE_SECONDS = 5  # longest clip the silence check is applied to
+
+# Vision model label folded into analysis cache keys
+# (Whisper uses groq_cloud_service.WHISPER_MODEL)
+VISION_CACHE_MODEL = "llava"
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+# Shared HTTP client - one connection pool per process, so Supabase
+# REST and storage calls reuse keep-alive connections instead of
+# re-negotiating TLS for every request.
+_HTTP_CLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(120.0, connect=10.0),
+    limits=httpx.Limits(max_connections=256, max_keepalive_connections=128),
+    http2=_HTTP2_AVAILABLE,
+)
+
+
+def _remove_file(path: str):
+    """Best-effort temp file cleanup"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+async def _run_tool(*args: str) -> Optional[bytes]:
+    """Run an ffmpeg-family tool, returning stdout (None if missing or failed)"""
+    if shutil.which(args[0]) is None:
+        return None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await proc.communicate()
+    except OSError:
+        return None
+    return stdout if proc.returncode == 0 else None
+
+
+async def _probe_media(path: str) -> Optional[Dict[str, Any]]:
+    """
+    ffprobe the file's streams.
+    Returns {"has_audio", "has_video", "duration"} or None if ffprobe is unavailable.
+    """
+    out = await _run_tool(
+        "ffprobe", "-v", "quiet", "-print_format", "json",
+        "-show_streams", "-show_format", path
+    )
+    if out is None:
+        return None
+    try:
+        info = _json_loads(out)
+    except ValueError:
+        return None
+    
+    streams = info.get("streams", [])
+    try:
+        duration = float(info.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    
+    return {
+        "has_audio": any(st.get("codec_type") == "audio" for st in streams),
+        "has_video": any(st.get("codec_type") == "video" for st in streams),
+        "duration": duration,
+    }
+
+
+async def _is_silent(path: str) -> bool:
+    """True if the first few seconds of audio are below SILENCE_DBFS"""
+    pcm = await _run_tool(
+        "ffmpeg", "-v", "quiet", "-t", str(SILENCE_PROBE_SECONDS), "-i", path,
+        "-ac", "1", "-ar", "16000", "-f", "s16le", "-"
+    )
+    if not pcm:
+        return False
+    
+    try:
+        import numpy as np
+    except ImportError:
+        return False
+    
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype=np.int16).astype(np.float32)
+    rms = float(np.sqrt(np.mean(samples * samples)))
+    dbfs = 20 * math.log10(rms / 32768) if rms > 0 else -math.inf
+    return dbfs < SILENCE_DBFS
+
+
+def _is_retryable(error: Exception) -> bool:
+    """True for rate-limit / server errors and dropped connections"""
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError))
+
 
 class SupabaseSyncService:
     """
@@ -37,13 +171,18 @@ class SupabaseSyncService:
     def __init__(self):
         self.supabase_url = SUPABASE_URL
         self.supabase_key = SUPABASE_ANON_KEY
-        self.client = httpx.AsyncClient(timeout=120.0)
+        self.client = _HTTP_CLIENT
         
         if self.supabase_url and self.supabase_key:
             logger.info(f"[OK] Supabase Sync initialized: {self.supabase_url[:30]}...")
         else:
             logger.warning("[WARN] Supabase credentials not configured")
     
+    async def close(self):
+        """Close the shared HTTP client. Call once from the app's lifespan shutdown."""
+        if not _HTTP_CLIENT.is_closed:
+            await _HTTP_CLIENT.aclose()
+    
     async def get_user_media(self, user_id: str) -> List[Dict]:
         """Fetch all media records for a user from Supabase"""
         if not self.supabase_url:
@@ -61,7 +200,7 @@ class SupabaseSyncService:
             response = await self.client.get(url, headers=headers, params=params)
             
             if response.status_code == 200:
-                media_list = response.json()
+                media_list = _json_loads(response.content)
                 logger.info(f"[DATA] Found {len(media_list)} media items for user {user_id[:8]}...")
                 return media_list
             else:
@@ -72,29 +211,51 @@ class SupabaseSyncService:
             logger.error(f"[ERR] Supabase fetch error: {e}")
             return []
     
-    async def download_media(self, file_url: str) -> Optional[bytes]:
-        """Download media file from Supabase storage"""
+    async def download_media_to_file(self, file_url: str, suffix: str = ".tmp") -> Optional[Tuple[str, str]]:
+        """
+        Stream media file from Supabase storage into a temp file,
+        hashing it on the way through.
+        Returns (temp file path, SHA-256 hex digest) - caller must delete
+        the file - or None on failure.
+        """
         if not file_url:
             return None
         
-        try:
-            response = await self.client.get(file_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                logger.error(f"Download failed: {response.status_code}")
-                return None
-        except Exception as e:
-            logger.error(f"Download error: {e}")
+        h = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            temp_path = f.name
+            try:
+                async with self.client.stream("GET", file_url) as response:
+                    if response.status_code != 200:
+                        logger.error(f"Download failed: {response.status_code}")
+                        temp_path = None
+                    else:
+                        async for chunk in response.aiter_bytes(65536):
+                            f.write(chunk)
+                            h.update(chunk)
+            except Exception as e:
+                logger.error(f"Download error: {e}")
+                temp_path = None
+        
+        if temp_path is None:
+            _remove_file(f.name)
             return None
+        return temp_path, h.hexdigest()
     
-    async def analyze_media(self, file_bytes: bytes, media_type: str, filename: str) -> Dict:
+    async def analyze_media(
+        self,
+        file_path: str,
+        media_type: str,
+        filename: str,
+        digest: Optional[str] = None
+    ) -> Dict:
         """
         Analyze media using Groq:
         - Audio/Video: Whisper transcription
         - Image: LLaVA vision analysis
+        `digest` is the file's SHA-256 (cache key); hashed from disk if not given.
         """
-        from groq_cloud_service import get_groq_cloud_service
+        from groq_cloud_service import get_groq_cloud_service, WHISPER_MODEL
         groq = get_groq_cloud_service()
         
         result = {
@@ -108,46 +269,89 @@ class SupabaseSyncService:
             logger.warning("[WARN] Groq not available for analysis")
             return result
         
-        # Save temp file for analysis
-        suffix = os.path.splitext(filename)[1] or ".tmp"
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
-            f.write(file_bytes)
-            temp_path = f.name
+        run_whisper = media_type in ['audio', 'video']
+        run_vision = media_type in ['image', 'video']
         
-        try:
-            if media_type in ['audio', 'video']:
-                # Whisper transcription
-                transcript_result = groq.transcribe_audio(temp_path)
+        if os.path.getsize(file_path) < MIN_MEDIA_BYTES:
+            logger.info(f"[SKIP] {filename}: file too small to analyze")
+            return result
+        
+        from analysis_cache import get_analysis_cache, file_digest, make_key
+        cache = get_analysis_cache()
+        if digest is None:
+            digest = await asyncio.to_thread(file_digest, file_path)
+        
+        # Cached results first (cheap), so re-syncs never pay for preflight
+        transcript_result = None
+        vision_result = None
+        whisper_key = make_key(digest, WHISPER_MODEL)
+        vision_key = make_key(digest, VISION_CACHE_MODEL)
+        if run_whisper:
+            transcript_result = await asyncio.to_thread(cache.get, whisper_key)
+            if transcript_result is not None:
+                logger.info(f"[CACHE] Transcript hit: {digest[:12]}")
+        if run_vision:
+            vision_result = await asyncio.to_thread(cache.get, vision_key)
+            if vision_result is not None:
+                logger.info(f"[CACHE] Vision hit: {digest[:12]}")
+        
+        # Preflight on a miss: skip API calls that cannot produce anything useful
+        if run_whisper and transcript_result is None:
+            probe = await _probe_media(file_path)
+            if probe is not None:
+                duration = probe["duration"]
+                if duration is not None and duration < MIN_MEDIA_DURATION:
+                    logger.info(f"[SKIP] {filename}: {duration:.2f}s is too short to analyze")
+                    return result
+                if not probe["has_audio"]:
+                    logger.info(f"[SKIP] {filename}: no audio stream, skipping Whisper")
+                    run_whisper = False
+                elif (
+                    not probe["has_video"]
+                    # Only the first SILENCE_PROBE_SECONDS are measured, so the
+                    # verdict only covers clips no longer than that
+                    and duration is not None
+                    and duration <= SILENCE_PROBE_SECONDS
+                    and await _is_silent(file_path)
+                ):
+                    logger.info(f"[SKIP] {filename}: silent audio, skipping Whisper")
+                    result["silent"] = True
+                    run_whisper = False
+        
+        if run_whisper:
+            # Whisper transcription (cached by content hash)
+            if transcript_result is None:
+                transcript_result = await asyncio.to_thread(groq.transcribe_audio, file_path)
                 if transcript_result and not transcript_result.get("error"):
-                    result["transcript"] = transcript_result.get("text", "")
-                    result["segments"] = transcript_result.get("segments", [])
-                    logger.info(f"[AUDIO] Transcribed: {len(result['transcript'])} chars")
-            
-            if media_type in ['image', 'video']:
-                # LLaVA vision analysis
-                try:
-                    from vision_api_service import get_vision_api_service
-                    vision = get_vision_api_service()
-                    vision_result = await vision.analyze_frame(temp_path)
-                    
-                    if vision_result and not vision_result.get("error"):
-                        # Convert forensic JSON to simple tags
-                        tags_list = vision.convert_to_tags(vision_result)
-                        result["tags"] = tags_list
-                        
-                        # Get description
-                        result["description"] = vision_result.get("visual_summary") or vision_result.get("summary", "")
-                        
-                        logger.info(f"[VISION] Vision: {len(tags_list)} tags")
-                except Exception as e:
-                    logger.warning(f"Vision analysis failed: {e}")
+                    await asyncio.to_thread(cache.set, whisper_key, transcript_result)
             
-        finally:
-            # Cleanup temp file
+            if transcript_result and not transcript_result.get("error"):
+                result["transcript"] = transcript_result.get("text", "")
+                result["segments"] = transcript_result.get("segments", [])
+                logger.info(f"[AUDIO] Transcribed: {len(result['transcript'])} chars")
+        
+        if run_vision:
+            # LLaVA vision analysis
             try:
-                os.unlink(temp_path)
-            except:
-                pass
+                from vision_api_service import get_vision_api_service
+                vision = get_vision_api_service()
+                
+                if vision_result is None:
+                    vision_result = await vision.analyze_frame(file_path)
+                    if vision_result and not vision_result.get("error"):
+                        await asyncio.to_thread(cache.set, vision_key, vision_result)
+                
+                if vision_result and not vision_result.get("error"):
+                    # Convert forensic JSON to simple tags
+                    tags_list = vision.convert_to_tags(vision_result)
+                    result["tags"] = tags_list
+                    
+                    # Get description
+                    result["description"] = vision_result.get("visual_summary") or vision_result.get("summary", "")
+                    
+                    logger.info(f"[VISION] Vision: {len(tags_list)} tags")
+            except Exception as e:
+                logger.warning(f"Vision analysis failed: {e}")
         
         return result
     
@@ -179,21 +383,63 @@ class SupabaseSyncService:
         # Always store something (at minimum the file info)
         content = f"Media ID: {media_id}\nUser: {user_id}\nType: {media_type}\nFile: {filename}\n\n" + "\n\n".join(content_parts)
         
-        try:
-            sm.add_memory(
-                content=content,
-                user_id=user_id,
-                media_id=media_id
-            )
-            logger.info(f"[CLOUD] Stored in Supermemory: {media_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Supermemory store failed: {e}")
-            return False
+        # Blocking client call runs in a thread so concurrent items' writes overlap
+        for attempt in range(STORE_MAX_RETRIES + 1):
+            try:
+                await asyncio.to_thread(
+                    sm.add_memory,
+                    content=content,
+                    user_id=user_id,
+                    media_id=media_id
+                )
+                logger.info(f"[CLOUD] Stored in Supermemory: {media_id}")
+                return True
+            except Exception as e:
+                if attempt < STORE_MAX_RETRIES and _is_retryable(e):
+                    delay = STORE_BACKOFF_BASE * (2 ** attempt)
+                    logger.warning(f"[WARN] Supermemory store retry {attempt + 1} in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"Supermemory store failed: {e}")
+                return False
+    
+    async def _run_stage(
+        self,
+        in_q: asyncio.Queue,
+        out_q: Optional[asyncio.Queue],
+        workers: int,
+        handle,
+        counts: Dict[str, int]
+    ):
+        """
+        Run `workers` consumers of in_q until _DONE arrives.
+        Non-None handler results go to out_q; _DONE is forwarded once all workers exit.
+        """
+        async def worker():
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    # Hand the marker on to the next sibling worker
+                    await in_q.put(_DONE)
+                    return
+                try:
+                    out = await handle(item)
+                except Exception as e:
+                    logger.error(f"[ERR] Failed to process {item[0].get('id', '')}: {e}")
+                    counts["errors"] += 1
+                    continue
+                if out is not None and out_q is not None:
+                    await out_q.put(out)
+        
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if out_q is not None:
+            await out_q.put(_DONE)
     
     async def sync_user_media(self, user_id: str) -> Dict:
         """
         Full sync: Fetch → Analyze → Store
+        Runs as a 3-stage pipeline so downloads, Groq analysis and
+        Supermemory writes for different items overlap.
         Returns summary of processed items.
         """
         logger.info(f"[SYNC] Starting sync for user: {user_id[:8]}...")
@@ -203,39 +449,58 @@ class SupabaseSyncService:
         if not media_list:
             return {"status": "no_media", "processed": 0, "total": 0}
         
-        processed = 0
-        errors = 0
+        counts = {"processed": 0, "errors": 0}
+        dl_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        an_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        st_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        
+        async def feed():
+            for media in media_list:
+                if media.get("file_url"):
+                    await dl_q.put((media,))
+            await dl_q.put(_DONE)
         
-        for media in media_list:
-            media_id = media.get("id", "")
-            file_url = media.get("file_url", "")
-            media_type = media.get("type", "image")
+        async def download(item):
+            media, = item
             filename = media.get("file_name", "file")
-            
-            if not file_url:
-                continue
-            
+            suffix = os.path.splitext(filename)[1] or ".tmp"
+            downloaded = await self.download_media_to_file(media["file_url"], suffix)
+            if not downloaded:
+                counts["errors"] += 1
+                return None
+            file_path, digest = downloaded
+            return media, file_path, digest
+        
+        async def analyze(item):
+            media, file_path, digest = item
             try:
-                # Download
-                file_bytes = await self.download_media(file_url)
-                if not file_bytes:
-                    errors += 1
-                    continue
-                
-                # Analyze
-                analysis = await self.analyze_media(file_bytes, media_type, filename)
-                
-                # Store
-                success = await self.store_to_supermemory(media_id, user_id, analysis, media_type, filename)
-                
-                if success:
-                    processed += 1
-                else:
-                    errors += 1
-                    
-            except Exception as e:
-                logger.error(f"[ERR] Failed to process {media_id}: {e}")
-                errors += 1
+                analysis = await self.analyze_media(
+                    file_path, media.get("type", "image"), media.get("file_name", "file"), digest
+                )
+            finally:
+                _remove_file(file_path)
+            return media, analysis
+        
+        async def store(item):
+            media, analysis = item
+            success = await self.store_to_supermemory(
+                media.get("id", ""),
+                user_id,
+                analysis,
+                media.get("type", "image"),
+                media.get("file_name", "file")
+            )
+            counts["processed" if success else "errors"] += 1
+        
+        await asyncio.gather(
+            feed(),
+            self._run_stage(dl_q, an_q, DOWNLOAD_WORKERS, download, counts),
+            self._run_stage(an_q, st_q, ANALYZE_WORKERS, analyze, counts),
+            self._run_stage(st_q, None, STORE_WORKERS, store, counts),
+        )
+        
+        processed = counts["processed"]
+        errors = counts["errors"]
         
         logger.info(f"[OK] Sync complete: {processed}/{len(media_list)} processed, {errors} errors")
         
@@ -1,13 +1,15 @@
 # Face Detection Server for SpecEI
-# Uses OpenCV with Haar Cascades for real-time face detection
+# Uses OpenCV's YuNet DNN face detector (INT8) for real-time face detection
 # Runs on http://localhost:8001
 
 import os
+import threading
+import urllib.request
 import cv2
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 import base64
 
@@ -22,21 +24,186 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load OpenCV's pre-trained face detector (Haar Cascade)
-# This is fast and works well for real-time detection
-CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+# Uvicorn worker processes; each has its own detectors
+WORKERS = int(os.environ.get("FACE_WORKERS", "1"))
 
-# Also load eye cascade for additional feature detection
+# Split cores between worker processes so OpenCV's DNN threads don't oversubscribe.
+# For VNNI int8 kernels, use an OpenCV build linked against oneDNN.
+cv2.setNumThreads(max(1, (os.cpu_count() or 1) // WORKERS))
+
+# Run YuNet on CUDA in FP16 when a GPU is present and OpenCV's DNN module
+# was built with the CUDA backend (which also needs cuDNN)
+def cuda_available():
+    try:
+        if cv2.cuda.getCudaEnabledDeviceCount() <= 0:
+            return False
+        targets = cv2.dnn.getAvailableTargets(cv2.dnn.DNN_BACKEND_CUDA)
+        return cv2.dnn.DNN_TARGET_CUDA_FP16 in targets
+    except (AttributeError, cv2.error):
+        return False
+
+USE_CUDA = cuda_available()
+if USE_CUDA:
+    DNN_BACKEND, DNN_TARGET = cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA_FP16
+else:
+    DNN_BACKEND, DNN_TARGET = cv2.dnn.DNN_BACKEND_DEFAULT, cv2.dnn.DNN_TARGET_CPU
+
+# YuNet face detector from the OpenCV model zoo: INT8 on CPU, FP32 weights
+# (run as FP16) on CUDA since the CUDA backend has no int8 kernels.
+# Downloaded on first start if not already present
+YUNET_FILE = "face_detection_yunet_2023mar.onnx" if USE_CUDA else "face_detection_yunet_2023mar_int8.onnx"
+YUNET_URL = "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/" + YUNET_FILE
+YUNET_PATH = os.environ.get(
+    "YUNET_MODEL_PATH",
+    os.path.join(os.path.dirname(__file__), "models", YUNET_FILE),
+)
+SCORE_THRESHOLD = 0.6
+
+# Longest image edge used for detection; larger uploads are downscaled
+MAX_DETECT_DIM = 640
+
+def ensure_face_model():
+    if not os.path.exists(YUNET_PATH):
+        print(f"⬇️ Downloading YuNet model to {YUNET_PATH}...")
+        os.makedirs(os.path.dirname(YUNET_PATH), exist_ok=True)
+        # Download beside the target and rename, so an interrupted download
+        # never leaves a truncated model at YUNET_PATH
+        partial_path = YUNET_PATH + ".part"
+        try:
+            urllib.request.urlretrieve(YUNET_URL, partial_path)
+            os.replace(partial_path, YUNET_PATH)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+ensure_face_model()
+
+# Haar eye cascade for additional feature detection
 EYE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_eye.xml"
-eye_cascade = cv2.CascadeClassifier(EYE_CASCADE_PATH)
 
-print(f"✅ Face detector loaded: {CASCADE_PATH}")
+# setInputSize mutates detector state, so each request thread gets its own
+# detector (created once per thread, not per request)
+_thread_models = threading.local()
+
+def get_face_detector():
+    detector = getattr(_thread_models, "face_detector", None)
+    if detector is None:
+        detector = cv2.FaceDetectorYN.create(
+            YUNET_PATH, "", (0, 0),
+            score_threshold=SCORE_THRESHOLD,
+            backend_id=DNN_BACKEND,
+            target_id=DNN_TARGET,
+        )
+        _thread_models.face_detector = detector
+    return detector
+
+def get_eye_cascade():
+    cascade = getattr(_thread_models, "eye_cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(EYE_CASCADE_PATH)
+        _thread_models.eye_cascade = cascade
+    return cascade
+
+# Load once at startup so a broken model fails fast
+get_face_detector()
+print(f"✅ Face detector loaded: {YUNET_PATH} ({'CUDA FP16' if USE_CUDA else 'CPU'})")
+
+def detect_face_boxes(img):
+    """
+    Run YuNet on a BGR image.
+    Returns (boxes, scores): Nx4 int32 array of x, y, w, h and N float scores.
+    """
+    face_detector = get_face_detector()
+    h, w = img.shape[:2]
+    face_detector.setInputSize((w, h))
+    _, faces = face_detector.detect(img)
+    
+    if faces is None:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32)
+    
+    # YuNet rows: x, y, w, h, 5 landmark (x, y) pairs, score
+    boxes = faces[:, :4].astype(np.int32)
+    boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+    return boxes, faces[:, 14]
+
+def downscale_for_detection(img):
+    """
+    Shrink img so its longest edge is at most MAX_DETECT_DIM.
+    Returns (image, scale) where scale maps original → detection coords.
+    """
+    scale = MAX_DETECT_DIM / max(img.shape[:2])
+    if scale >= 1.0:
+        return img, 1.0
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return small, scale
+
+def to_original_coords(boxes, scale):
+    """Map detection-space boxes back to original image coordinates"""
+    if scale == 1.0:
+        return boxes
+    return (boxes / scale).astype(np.int32)
 
 @app.get("/")
 def health_check():
     return {"status": "running", "service": "face_detection"}
 
+def detect_full_response(img_bytes):
+    """
+    Decode image bytes, detect faces and count eyes per face.
+    Returns the full /detect response.
+    """
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    if img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    
+    # Detect faces on a downscaled copy
+    small, scale = downscale_for_detection(img)
+    faces, scores = detect_face_boxes(small)
+    
+    # Count eyes per face: one eye pass over the whole frame, then a
+    # vectorized containment test of eye centers against face boxes
+    eye_counts = np.zeros(len(faces), dtype=np.int64)
+    if len(faces):
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        all_eyes = np.asarray(get_eye_cascade().detectMultiScale(gray, minSize=(10, 10))).reshape(-1, 4)
+        if len(all_eyes):
+            eye_cx = all_eyes[:, 0] + all_eyes[:, 2] // 2
+            eye_cy = all_eyes[:, 1] + all_eyes[:, 3] // 2
+            fx, fy = faces[:, 0:1], faces[:, 1:2]
+            fw, fh = faces[:, 2:3], faces[:, 3:4]
+            mask = (
+                (eye_cx >= fx) & (eye_cx < fx + fw) &
+                (eye_cy >= fy) & (eye_cy < fy + fh)
+            )
+            eye_counts = mask.sum(axis=1)
+    
+    # Build response with face data (boxes in original image coordinates)
+    face_data = [
+        {
+            "id": i + 1,
+            "x": x,
+            "y": y,
+            "width": w,
+            "height": h,
+            "confidence": round(score, 3),
+            "eyes_detected": eyes,
+        }
+        for i, ((x, y, w, h), score, eyes) in enumerate(zip(
+            to_original_coords(faces, scale).tolist(),
+            scores.tolist(),
+            eye_counts.tolist(),
+        ))
+    ]
+    
+    return {
+        "face_count": len(faces),
+        "faces": face_data,
+        "image_width": img.shape[1],
+        "image_height": img.shape[0],
+    }
+
 @app.post("/detect")
 async def detect_faces(file: UploadFile = File(...)):
     """
@@ -46,53 +213,41 @@ async def detect_faces(file: UploadFile = File(...)):
     try:
         # Read image bytes
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not decode image")
-        
-        # Convert to grayscale for detection
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30),
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-        
-        # Build response with face data
-        face_data = []
-        for i, (x, y, w, h) in enumerate(faces):
-            # Get face region for eye detection
-            roi_gray = gray[y:y+h, x:x+w]
-            eyes = eye_cascade.detectMultiScale(roi_gray)
-            
-            face_info = {
-                "id": i + 1,
-                "x": int(x),
-                "y": int(y),
-                "width": int(w),
-                "height": int(h),
-                "confidence": 0.85,  # Haar doesn't give confidence, using default
-                "eyes_detected": len(eyes),
-            }
-            face_data.append(face_info)
         
-        return JSONResponse({
-            "face_count": len(faces),
-            "faces": face_data,
-            "image_width": img.shape[1],
-            "image_height": img.shape[0],
-        })
+        # Detection runs in the threadpool (thread-local detectors)
+        return await run_in_threadpool(detect_full_response, contents)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def detect_boxes_response(img_bytes):
+    """
+    Decode image bytes and detect faces.
+    Returns the lightweight response used by the real-time endpoints.
+    """
+    nparr = np.frombuffer(img_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    if img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    
+    # Detect faces on a downscaled copy
+    small, scale = downscale_for_detection(img)
+    faces, _ = detect_face_boxes(small)
+    
+    face_data = [
+        {"id": i + 1, "x": x, "y": y, "width": w, "height": h}
+        for i, (x, y, w, h) in enumerate(to_original_coords(faces, scale).tolist())
+    ]
+    
+    return {
+        "face_count": len(faces),
+        "faces": face_data,
+    }
+
 @app.post("/detect_base64")
 async def detect_faces_base64(data: dict):
     """
@@ -104,44 +259,36 @@ async def detect_faces_base64(data: dict):
         if not image_data:
             raise HTTPException(status_code=400, detail="No image data provided")
         
-        # Remove data URL prefix if present
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
+        # Remove data URL prefix if present (it only ever sits in the head)
+        comma = image_data.find(",", 0, 64)
+        if comma != -1:
+            image_data = image_data[comma + 1:]
         
         # Decode base64
-        img_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not decode image")
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img_bytes = base64.b64decode(image_data, validate=False)
+        return await run_in_threadpool(detect_boxes_response, img_bytes)
         
-        # Detect faces (optimized for speed)
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.2,  # Faster but less accurate
-            minNeighbors=4,
-            minSize=(50, 50),
-        )
-        
-        face_data = []
-        for i, (x, y, w, h) in enumerate(faces):
-            face_data.append({
-                "id": i + 1,
-                "x": int(x),
-                "y": int(y),
-                "width": int(w),
-                "height": int(h),
-            })
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect_raw")
+async def detect_faces_raw(request: Request):
+    """
+    Detect faces from a raw image request body (e.g. image/jpeg).
+    Same response as /detect_base64 without the base64 overhead.
+    """
+    try:
+        img_bytes = await request.body()
+        if not img_bytes:
+            raise HTTPException(status_code=400, detail="No image data provided")
         
-        return {
-            "face_count": len(faces),
-            "faces": face_data,
-        }
+        return await run_in_threadpool(detect_boxes_response, img_bytes)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -151,4 +298,9 @@ if __name__ == "__main__":
     print("📱 Endpoints:")
     print("   POST /detect - Upload image file")
     print("   POST /detect_base64 - Send base64 image")
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    print("   POST /detect_raw - Send raw image bytes")
+    # Multiple workers need an import string; uvicorn picks uvloop when installed
+    if WORKERS > 1:
+        uvicorn.run("face_detection_server:app", host="0.0.0.0", port=8001, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -1,8 +1,12 @@
 import os
-import shutil
+import numpy as np
+import orjson
+import ctranslate2
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from faster_whisper import WhisperModel
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from faster_whisper import WhisperModel, BatchedInferencePipeline
 import uvicorn
 
 app = FastAPI(title="SpecEI Local Whisper Server")
@@ -20,53 +24,127 @@ app.add_middleware(
 # "tiny", "base", "small", "medium", "large-v3"
 # Use "tiny" or "base" for CPU. Use "medium" or larger if you have a GPU.
 MODEL_SIZE = "base" 
-DEVICE = "auto" # "cuda" if GPU available, else "cpu"
-COMPUTE_TYPE = "int8" # "float16" for GPU, "int8" for CPU
+HAS_CUDA = ctranslate2.get_cuda_device_count() > 0
+DEVICE = "cuda" if HAS_CUDA else "cpu"
+# "float16" for GPU, "int8" for CPU; set WHISPER_COMPUTE_TYPE=int8_float16 on mid-tier GPUs
+COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "float16" if HAS_CUDA else "int8")
+NUM_WORKERS = 2 # Overlap CPU preprocessing of one request with model compute of another
+BATCH_SIZE = 8 # Audio chunks decoded together by the batched pipeline
 
-print(f"Loading Whisper model: {MODEL_SIZE} on {DEVICE}...")
+def warm_up(whisper_model):
+    """
+    Run 1s of silence through the model so the first real request doesn't pay
+    for kernel setup and buffer allocation (segments are lazy, so consume them).
+    Also surfaces GPU library errors (cuDNN/cuBLAS) that only appear on first inference.
+    """
+    list(whisper_model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)[0])
+
+print(f"Loading Whisper model: {MODEL_SIZE} on {DEVICE} ({COMPUTE_TYPE})...")
 try:
-    model = WhisperModel(MODEL_SIZE, device=DEVICE, compute_type=COMPUTE_TYPE)
+    model = WhisperModel(MODEL_SIZE, device=DEVICE, compute_type=COMPUTE_TYPE, num_workers=NUM_WORKERS)
+    warm_up(model)
     print("✅ Model loaded successfully!")
 except Exception as e:
     print(f"❌ Error loading model: {e}")
     print("Using CPU fallback configuration...")
-    model = WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8")
+    model = WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8", num_workers=NUM_WORKERS)
+    warm_up(model)
+print("✅ Model warmed up")
+
+# Batched pipeline for the default greedy path: VAD-split chunks are
+# encoded/decoded together instead of one window at a time
+batched_model = BatchedInferencePipeline(model=model)
 
 @app.get("/")
 def health_check():
     return {"status": "running", "model": MODEL_SIZE}
 
+def start_transcription(file: UploadFile, accurate: bool = False, stream: bool = False):
+    """
+    Start transcribing an upload in place.
+    Returns faster-whisper's lazy (segments, info); decoding runs as segments are iterated.
+    Default is greedy batched decoding; accurate=True uses beam search;
+    stream=True decodes greedily one segment at a time so each is yielded as soon as it's ready.
+    """
+    print("📝 Transcribing...")
+    file.file.seek(0)
+    if accurate:
+        return model.transcribe(file.file, beam_size=5, vad_filter=True)
+    if stream:
+        return model.transcribe(file.file, beam_size=1, vad_filter=True)
+    return batched_model.transcribe(
+        file.file,
+        beam_size=1,
+        batch_size=BATCH_SIZE,
+        condition_on_previous_text=False,
+    )
+
+def run_transcription(file: UploadFile, accurate: bool = False):
+    """Transcribe an upload and return the full text"""
+    segments, info = start_transcription(file, accurate)
+    
+    transcription = " ".join([segment.text for segment in segments]).strip()
+    print(f"✅ Result: {transcription}")
+    
+    return {
+        "text": transcription,
+        "language": info.language,
+        "probability": info.language_probability
+    }
+
 @app.post("/transcribe")
 async def transcribe_audio(file: UploadFile = File(...)):
     print(f"🎤 Received audio file: {file.filename}")
     
-    # Save uploaded file temporarily
-    temp_filename = f"temp_{file.filename}"
     try:
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Transcribe
-        print("📝 Transcribing...")
-        segments, info = model.transcribe(temp_filename, beam_size=5)
-        
-        transcription = " ".join([segment.text for segment in segments]).strip()
-        print(f"✅ Result: {transcription}")
-        
-        return {
-            "text": transcription,
-            "language": info.language,
-            "probability": info.language_probability
-        }
+        # Threadpool so concurrent requests use the model's parallel workers
+        return await run_in_threadpool(run_transcription, file)
         
     except Exception as e:
         print(f"❌ Error during transcription: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/transcribe_accurate")
+async def transcribe_audio_accurate(file: UploadFile = File(...)):
+    """Beam search (beam_size=5) for quality-critical transcriptions."""
+    print(f"🎤 Received audio file (accurate): {file.filename}")
+    
+    try:
+        return await run_in_threadpool(run_transcription, file, accurate=True)
         
-    finally:
-        # Cleanup temp file
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+    except Exception as e:
+        print(f"❌ Error during transcription: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/transcribe_stream")
+async def transcribe_audio_stream(file: UploadFile = File(...)):
+    """
+    Stream segments as Server-Sent Events while they are decoded.
+    Each segment is a `data:` event; a final `done` event carries language info.
+    """
+    print(f"🎤 Received audio file (stream): {file.filename}")
+    
+    try:
+        # Audio decode and language detection happen here, off the event loop;
+        # segments stay lazy until the response iterates them
+        segments, info = await run_in_threadpool(start_transcription, file, stream=True)
+    except Exception as e:
+        print(f"❌ Error during transcription: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Sync generator: Starlette iterates it in a worker thread, so
+    # segment decoding doesn't block the event loop
+    def events():
+        try:
+            for seg in segments:
+                yield b"data: " + orjson.dumps({"text": seg.text, "start": seg.start, "end": seg.end}) + b"\n\n"
+            done = {"language": info.language, "probability": info.language_probability}
+            yield b"event: done\ndata: " + orjson.dumps(done) + b"\n\n"
+        except Exception as e:
+            print(f"❌ Error during transcription: {e}")
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     print("🚀 Starting Whisper Server on http://0.0.0.0:8000")